@@ -1,34 +1,349 @@
 import os
 import re
+import sys
 import time
-import json
+import errno
+import asyncio
 import logging
-import requests
-import subprocess
 from pathlib import Path
-from typing import List, Dict, Optional, Tuple, Set
+from typing import List, Dict, Optional, Tuple, Set, AsyncIterator
 from dataclasses import dataclass
-from http.cookies import SimpleCookie, CookieError
+import aiohttp
+import google_crc32c
+import ijson
+import orjson
 from tqdm import tqdm
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
+from yarl import URL
 
-def get_session_with_retries(timeout: int = 60, retries: int = 5) -> requests.Session:
+# API 请求遇到这些状态码时按指数退避重试
+RETRY_STATUS = {429, 500, 502, 503, 504}
+# Bilibili 风控拦截的业务错误码（请求过于频繁）
+RATE_LIMIT_CODES = {-412, -352}
+# 小于 分段数 * MIN_PART_SIZE 的文件不值得分段下载
+MIN_PART_SIZE = 1 << 20
+# 下载时每次读取的块大小上限（aiohttp 只取已到达的数据，不会为凑满而等待），
+# 以及攒够多少数据提交一次写入
+CHUNK_SIZE = 1 << 20
+WRITE_BATCH_SIZE = 1 << 20
+# Windows 下 os.open 需要 O_BINARY，其他平台为 0
+O_BINARY = getattr(os, "O_BINARY", 0)
+# 单次 pwritev 最多提交的缓冲区个数，不支持 pwritev 的平台为 0
+IOV_MAX = os.sysconf("SC_IOV_MAX") if hasattr(os, "pwritev") else 0
+# FFmpeg 的输入选项：dash 分片的编码参数都在 moov 里，不必读取数据包探测流信息
+FFMPEG_INPUT_ARGS = ("-probesize", "32", "-analyzeduration", "0")
+# 计算校验和时每次读取的块大小
+HASH_CHUNK_SIZE = 1 << 20
+# 预取收藏夹元数据（view / playurl）时的并发请求数
+METADATA_CONCURRENCY = 10
+# playurl 返回的 CDN 地址带有效期，缓存超过该秒数后重新获取
+PLAYURL_TTL = 30 * 60
+
+# 文件名清理：纯字符删除用 str.translate，其余规则预编译
+_FS_STRIP = str.maketrans("", "", r'\/:*?"<>|')
+_TITLE_SPECIAL_RE = re.compile(r'[\\/:*?"<>|【】()\[\]《》\s\U00010000-\U0010ffff]')  # 过滤特殊符号和表情
+_SPACES_RE = re.compile(r'\s+')
+_UPNAME_STRIP_RE = re.compile(r'[^a-zA-Z0-9\u4e00-\u9fa5]')  # 去除非中英文字符
+_MULTI_UNDERSCORE_RE = re.compile(r'_{2,}')
+# 从 Cookie 字符串中提取用户 ID
+_DEDE_RE = re.compile(r'(?:^|;\s*)DedeUserID=(\d+)\s*(?:;|$)')
+
+
+class _RangeNotSupported(Exception):
+    """服务器忽略 Range 请求头（返回 200 而不是 206）"""
+
+
+class _DownloadFailed(Exception):
+    """某一路媒体流重试后仍下载失败"""
+
+
+class _UrlExpired(Exception):
+    """CDN 拒绝了媒体地址（403），通常是 playurl 返回的地址已过期，需要重新获取"""
+
+
+def _is_forbidden(exc: BaseException) -> bool:
+    """exc（或其中任一子异常）是否为 HTTP 403"""
+    def forbidden(e: BaseException) -> bool:
+        return isinstance(e, aiohttp.ClientResponseError) and e.status == 403
+    if isinstance(exc, BaseExceptionGroup):
+        return exc.subgroup(forbidden) is not None
+    return forbidden(exc)
+
+
+def advise_sequential(fd: int):
+    """
+    提示内核该文件按顺序访问且写入后不会再复用，不支持 posix_fadvise 的平台上什么也不做
+    """
+    if hasattr(os, "posix_fadvise"):
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_NOREUSE)
+
+
+def parse_cookies(raw: str) -> Dict[str, str]:
+    """
+    将浏览器复制的 Cookie 字符串（a=1; b=2）解析为字典
     """
-    创建一个带重试机制的 Session，设置默认超时时间
+    cookies = {}
+    for item in raw.split(";"):
+        name, sep, value = item.strip().partition("=")
+        if sep and name:
+            cookies[name] = value
+    return cookies
+
+
+def create_session(headers: Dict[str, str], cookies: Dict[str, str], limit_per_host: int = 8,
+                   connect_timeout: float = 10, read_timeout: float = 30) -> aiohttp.ClientSession:
     """
-    session = requests.Session()
-    retry_strategy = Retry(
-        total=retries,
-        backoff_factor=1,
-        status_forcelist=[429, 500, 502, 503, 504],
-        allowed_methods=["HEAD", "GET", "OPTIONS"]
+    创建共享连接池的 aiohttp Session，所有 API 与 CDN 请求复用 keep-alive 连接
+    超时只限制建连与单次读取，不限制大文件下载的总时长
+    """
+    connector = aiohttp.TCPConnector(
+        limit=max(100, limit_per_host), limit_per_host=limit_per_host, keepalive_timeout=75, ttl_dns_cache=300
+    )
+    return aiohttp.ClientSession(
+        connector=connector,
+        headers=headers,
+        cookies=cookies,
+        timeout=aiohttp.ClientTimeout(total=None, sock_connect=connect_timeout, sock_read=read_timeout)
     )
-    adapter = HTTPAdapter(max_retries=retry_strategy)
-    session.mount("http://", adapter)
-    session.mount("https://", adapter)
-    session.request_timeout = timeout
-    return session
+
+def write_at(fd: int, data: bytes, offset: int):
+    """
+    将 data 完整写入 fd 的 offset 处，没有 os.pwrite 的平台退化为 lseek + write
+    """
+    view = memoryview(data)
+    while view:
+        if hasattr(os, "pwrite"):
+            written = os.pwrite(fd, view, offset)
+        else:
+            os.lseek(fd, offset, os.SEEK_SET)
+            written = os.write(fd, view)
+        view = view[written:]
+        offset += written
+
+
+def file_crc32c(path: Path) -> str:
+    """
+    计算文件的 CRC32C（google-crc32c 在支持的 CPU 上使用硬件 CRC32 指令），返回十六进制字符串
+    """
+    checksum = google_crc32c.Checksum()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            checksum.update(chunk)
+    return checksum.hexdigest().decode()
+
+
+def remove_file(path: str):
+    """
+    删除文件，文件不存在时什么也不做
+    """
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+def writev_at(fd: int, buffers: List[bytes], offset: int):
+    """
+    用一次 os.pwritev 把多个数据块写入 fd 的 offset 处，省去先拼接成一整块的复制；
+    平台不支持或块数超过 IOV_MAX 时退化为拼接后 write_at
+    """
+    if len(buffers) > IOV_MAX:
+        write_at(fd, b"".join(buffers), offset)
+        return
+    total = sum(len(b) for b in buffers)
+    written = os.pwritev(fd, buffers, offset)
+    if written < total:
+        write_at(fd, memoryview(b"".join(buffers))[written:], offset + written)
+
+
+def preallocate(fd: int, size: int):
+    """
+    为文件预先分配 size 字节的磁盘空间，各分段并发写入时不会产生碎片；
+    不支持 posix_fallocate 的平台或文件系统上退化为 ftruncate
+    """
+    if hasattr(os, "posix_fallocate"):
+        try:
+            os.posix_fallocate(fd, 0, size)
+            return
+        except OSError as e:
+            if e.errno not in (errno.EOPNOTSUPP, errno.EINVAL):
+                raise
+    os.ftruncate(fd, size)
+
+
+def _index_streams(streams: Optional[List[Dict]]) -> Dict[int, Dict]:
+    """
+    单次遍历按 id 分组，每个 id 只保留码率最高的 dash 流
+    """
+    index = {}
+    for stream in streams or ():
+        best = index.get(stream["id"])
+        if best is None or stream["bandwidth"] > best["bandwidth"]:
+            index[stream["id"]] = stream
+    return index
+
+
+def _index_dash(dash: Optional[Dict]) -> Dict:
+    """
+    将 playurl 返回的 dash 整理为 {"video": {清晰度: 视频流}, "audio": 音频流}，之后选流只需查字典；
+    音频优先选取 hi-res（id==30251），没有时取码率最高的
+    """
+    videos = _index_streams(dash.get("video")) if dash else {}
+    audios = _index_streams(dash.get("audio")) if dash else {}
+    audio = audios.get(30251) or max(audios.values(), key=lambda s: s["bandwidth"], default=None)
+    return {"video": videos, "audio": audio}
+
+
+# ===================== 请求限速 =====================
+class RateLimiter:
+    """
+    令牌桶限速：平时最多 rate 次/秒（允许 burst 次突发），正常情况下不额外等待；
+    被限流时由 penalize 暂停放行一段时间并把速率减半，退避结束后由 reward 按成功持续的时间逐步恢复到 max_rate
+    （每秒恢复 step 次/秒）
+    """
+    def __init__(self, rate: float = 10.0, burst: int = 5,
+                 min_rate: float = 1.0, step: float = 0.5):
+        self.rate = rate
+        self.max_rate = rate
+        self.min_rate = min_rate
+        self.step = step
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        # 退避截止时间与上次恢复速率的时间
+        self._backoff_until = 0.0
+        self._last_reward = self._updated
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        # 持锁等待，保证等待中的请求按先后顺序放行
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                wait = self._backoff_until - now
+                if wait <= 0 and self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep(max(wait, (1 - self._tokens) / self.rate))
+
+    def penalize(self, seconds: float):
+        """
+        暂停放行 seconds 秒，清空已积累的令牌，并将速率减半；
+        同一轮退避期间并发请求陆续报告的限流只算一次，不重复减半
+        """
+        now = time.monotonic()
+        if now >= self._backoff_until:
+            self.rate = max(self.min_rate, self.rate / 2)
+        self._backoff_until = max(self._backoff_until, now + seconds)
+        self._last_reward = self._backoff_until
+        self._tokens = 0.0
+
+    def reward(self):
+        """
+        请求成功，速率按距上次恢复经过的时间加性恢复，不超过 max_rate；
+        恢复幅度只取决于时间，与并发请求数量无关
+        """
+        now = time.monotonic()
+        if now <= self._last_reward:
+            return
+        self.rate = min(self.max_rate, self.rate + self.step * (now - self._last_reward))
+        self._last_reward = now
+
+
+# ===================== 批量写入 =====================
+class BatchWriter:
+    """
+    攒批写入器：网络数据块先在内存中累积，满 batch_size 后合并为一次定位写入，
+    在线程中执行，最多一批在途，写盘与下一批的接收互相重叠且不阻塞事件循环
+    """
+    def __init__(self, fd: int, offset: int = 0, batch_size: int = WRITE_BATCH_SIZE):
+        self.fd = fd
+        self.offset = offset
+        self.batch_size = batch_size
+        self._chunks: List[bytes] = []
+        self._pending = 0
+        self._inflight: Optional[asyncio.Task] = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            await self.flush()
+        else:
+            # 出错（包括被取消）时也要等在途写入结束，调用方随后才能安全关闭 fd
+            try:
+                await self._wait_inflight()
+            except Exception:
+                pass
+
+    async def write(self, chunk: bytes):
+        self._chunks.append(chunk)
+        self._pending += len(chunk)
+        if self._pending >= self.batch_size:
+            await self._submit()
+
+    async def flush(self):
+        if self._chunks:
+            await self._submit()
+        await self._wait_inflight()
+
+    async def _submit(self):
+        await self._wait_inflight()
+        chunks, offset = self._chunks, self.offset
+        self.offset += self._pending
+        self._chunks = []
+        self._pending = 0
+        self._inflight = asyncio.create_task(asyncio.to_thread(writev_at, self.fd, chunks, offset))
+
+    async def _wait_inflight(self):
+        """
+        等待在途写入真正结束；等待期间被取消也继续等，写入线程结束后再把取消抛出
+        """
+        task = self._inflight
+        if task is None:
+            return
+        cancelled = None
+        while not task.done():
+            try:
+                await asyncio.wait({task})
+            except asyncio.CancelledError as e:
+                cancelled = e
+        self._inflight = None
+        if cancelled is not None:
+            raise cancelled
+        task.result()
+
+
+class _PipeProtocol(asyncio.Protocol):
+    """
+    命名管道写端的协议：传输层缓冲写满时暂停，FFmpeg 读走数据后恢复；
+    读端关闭后 drain 抛出 ConnectionResetError
+    """
+    def __init__(self):
+        self._can_write = asyncio.Event()
+        self._can_write.set()
+        self._lost = False
+
+    def pause_writing(self):
+        self._can_write.clear()
+
+    def resume_writing(self):
+        self._can_write.set()
+
+    def connection_lost(self, exc):
+        self._lost = True
+        self._can_write.set()
+
+    async def drain(self):
+        if self._lost:
+            raise ConnectionResetError("管道已关闭")
+        await self._can_write.wait()
+        if self._lost:
+            raise ConnectionResetError("管道已关闭")
+
 
 # ===================== 配置类 =====================
 # @dataclass
@@ -55,39 +370,132 @@ class Config:
     cookies: str
     save_path: Path = Path("./downloads")
     ffmpeg_path: str = "ffmpeg"
-    request_interval: float = 1.5
+    # 分页接口翻页之间的额外间隔（秒），默认只依赖自适应限速
+    request_interval: float = 0.0
     max_retries: int = 3
-    history_file: Path = Path("./download_history.json")
+    # JSON Lines 格式，每行一条下载记录，只追加不重写
+    history_file: Path = Path("./download_history.jsonl")
     temp_dir: Path = Path("./temp")
     # 新增的三个配置项必须显式声明
     max_title_length: int = 80
     max_filename_length: int = 240
     upname_max_length: int = 10
+    # 同时处理的视频数，过大容易触发 429
+    max_concurrent_downloads: int = 5
+    # 单个媒体文件的分段并发数，1 表示不分段
+    download_parts: int = 4
+    # 通过命名管道把音视频直接送入 FFmpeg，不写临时文件（仅 Linux/macOS）
+    pipe_to_ffmpeg: bool = False
 
     def __post_init__(self):
         self.save_path.mkdir(parents=True, exist_ok=True)
         self.temp_dir.mkdir(parents=True, exist_ok=True)
-        if not self.history_file.exists():
-            with open(self.history_file, "w", encoding="utf-8") as f:
-                json.dump([], f, indent=2, ensure_ascii=False)
+        self.history_file.touch(exist_ok=True)
+        # 临时文件路径在下载热路径上用字符串拼接，不再每次构造 Path
+        self._temp_str = os.fspath(self.temp_dir)
 
 
 # ===================== 核心下载器类 =====================
 class BilibiliDownloader:
     def __init__(self, config: Config):
         self.config = config
-        self.session = get_session_with_retries(timeout=60, retries=5)
-        self._init_session()
+        self.session: Optional[aiohttp.ClientSession] = None
+        self._history_fp = None
+        # 用户 ID 只从 Cookie 中提取一次
+        m = _DEDE_RE.search(config.cookies.strip())
+        self._dede_userid: Optional[str] = m.group(1) if m else None
+        # 只限制 API 请求，CDN 媒体下载不受影响
+        self.limiter = RateLimiter()
         self.logger = self._setup_logger()
-        self.downloaded = self._load_download_history()
+        # 启动时加载的历史记录不再变化，冻结为 frozenset；本次运行新增的记录单独存放
+        # 以最高画质模式完整下载过（主版本及 HDR 版本都已完成）的分P (bvid, cid)，
+        # 用于跳过这些视频的元数据请求
+        self._completed_pages: Set[Tuple[str, int]] = set()
+        self._downloaded_loaded: frozenset = frozenset(self._load_download_history())
+        self._downloaded_session: Set[Tuple[str, int, int]] = set()
+        # 正在下载中的输出路径，避免并发任务选中同一个文件名
+        self._pending_outputs: Set[Path] = set()
+        # 正在下载中的 (bvid, cid, quality)，同一内容只下载一次
+        self._active_downloads: Dict[Tuple[str, int, int], asyncio.Event] = {}
+        # 本次运行内的接口缓存：view 按 bvid，playurl 按 (bvid, cid, qn)
+        self._view_cache: Dict[str, Dict] = {}
+        self._playurl_cache: Dict[Tuple[str, int, int], Tuple[float, Dict]] = {}
+        # get_playinfo 的解析结果按 (bvid, cid) 缓存，与所依据的 playurl 响应一同失效
+        self._playinfo_cache: Dict[Tuple[str, int], Tuple[Dict, Tuple[Dict[int, str], Dict]]] = {}
+        # 同时进行的元数据请求数、同时下载的视频数与同时运行的 FFmpeg 进程数
+        self._metadata_slots = asyncio.Semaphore(METADATA_CONCURRENCY)
+        self._download_slots = asyncio.Semaphore(config.max_concurrent_downloads)
+        merge_count = max(1, (os.cpu_count() or 2) // 2)
+        self._merge_slots = asyncio.Semaphore(merge_count)
+        # 磁盘上同时存在临时文件的视频数：下载中的加上合并中的，
+        # 避免合并跟不上时已下载完的临时文件在磁盘上无限堆积
+        self._temp_slots = asyncio.Semaphore(config.max_concurrent_downloads + merge_count)
+
+    async def __aenter__(self):
+        # aiohttp 的 Session 必须在事件循环中创建
+        self._init_session()
+        # 历史记录文件在整个运行期间只打开一次；不带缓冲，每条记录一次 write 立即落盘
+        self._history_fp = open(self.config.history_file, "ab", buffering=0)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.session.close()
+        self._history_fp.close()
+        self._compact_history()
 
     def _init_session(self):
         headers = {
             "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36",
-            "Referer": "https://www.bilibili.com",
-            "Cookie": self.config.cookies
+            "Referer": "https://www.bilibili.com"
         }
-        self.session.headers.update(headers)
+        # 同一 CDN 主机上最多同时有 视频数 × 音视频两路 × 分段数 个连接，连接池不能比这更小
+        limit_per_host = max(8, self.config.max_concurrent_downloads * 2 * self.config.download_parts)
+        # Cookie 只解析一次，交给 Session 的 cookie jar 统一附加
+        self.session = create_session(headers, parse_cookies(self.config.cookies), limit_per_host)
+
+    async def _get(self, url: str, params: dict = None, retries: int = 5) -> aiohttp.ClientResponse:
+        """
+        限速后发起 GET 请求，429/5xx 或连接异常时按指数退避重试
+        返回未读取的响应，调用方需用 async with 释放连接
+        """
+        for retry in range(retries):
+            last_try = retry == retries - 1
+            await self.limiter.acquire()
+            try:
+                resp = await self.session.get(url, params=params)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                if last_try:
+                    raise
+                await asyncio.sleep(2 ** retry)
+                continue
+            if resp.status in RETRY_STATUS and not last_try:
+                resp.release()
+                if resp.status == 429:
+                    # 被限流时暂停所有 API 请求，而不只是当前这一个
+                    self.limiter.penalize(2 ** retry)
+                else:
+                    await asyncio.sleep(2 ** retry)
+                continue
+            resp.raise_for_status()
+            return resp
+
+    async def _get_json(self, url: str, params: dict = None, retries: int = 5) -> Dict:
+        for retry in range(retries):
+            async with await self._get(url, params=params) as resp:
+                # 直接解析原始字节，省去先解码为 str 的步骤
+                data = orjson.loads(await resp.read())
+            if data.get("code") in RATE_LIMIT_CODES:
+                if retry < retries - 1:
+                    self._on_rate_limited(data["code"], retry)
+                    continue
+            else:
+                # 确认响应体没有风控错误码后才算成功请求
+                self.limiter.reward()
+            return data
+
+    def _on_rate_limited(self, code: int, retry: int):
+        self.logger.warning(f"触发风控（{code}），{2 ** retry} 秒后重试")
+        self.limiter.penalize(2 ** retry)
 
     def _setup_logger(self):
         logger = logging.getLogger("BiliDownloader")
@@ -102,186 +510,404 @@ class BilibiliDownloader:
         return logger
 
     # ------------------- 下载记录管理 -------------------
+    def is_downloaded(self, bvid: str, cid: int, quality: int) -> bool:
+        key = (bvid, cid, quality)
+        return key in self._downloaded_session or key in self._downloaded_loaded
+
+    def is_video_downloaded(self, bvid: str, cids: List[int]) -> bool:
+        """cids 中的每个分P是否都已以最高画质模式完整下载"""
+        return bool(cids) and all((bvid, cid) in self._completed_pages for cid in cids)
+
+    @property
+    def downloaded_count(self) -> int:
+        return len(self._downloaded_loaded) + len(self._downloaded_session)
+
     def _load_download_history(self) -> Set[Tuple[str, int, int]]:
         try:
-            if self.config.history_file.exists():
-                if self.config.history_file.stat().st_size == 0:
-                    return set()
-                with open(self.config.history_file, "r", encoding="utf-8") as f:
-                    records = json.load(f)
-                    return {(item["bvid"], item["cid"], item["quality"]) for item in records}
-            return set()
-        except json.JSONDecodeError:
-            self.logger.error("历史记录文件损坏，已重置")
-            return set()
+            self._migrate_legacy_history()
+            downloaded = set()
+            line = b""
+            with open(self.config.history_file, "rb") as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    try:
+                        item = orjson.loads(line)
+                    except orjson.JSONDecodeError:
+                        # 程序中断时可能留下写了一半的行
+                        self.logger.warning("跳过损坏的历史记录行")
+                        continue
+                    # 同一视频的多个分P共用一个 bvid 字符串，查重时比较指针即可
+                    bvid = sys.intern(item["bvid"])
+                    downloaded.add((bvid, item["cid"], item["quality"]))
+                    if item.get("complete"):
+                        self._completed_pages.add((bvid, item["cid"]))
+            if line and not line.endswith(b"\n"):
+                # 补上换行，避免下一条记录接在半行后面
+                with open(self.config.history_file, "ab") as f:
+                    f.write(b"\n")
+            return downloaded
         except Exception as e:
             self.logger.error(f"加载历史记录失败: {str(e)}")
             return set()
 
-    def _save_download_entry(self, bvid: str, cid: int, quality: int, title: str, up_name: str):
+    def _migrate_legacy_history(self):
+        """将旧版 download_history.json（整个 JSON 数组）转换为 JSON Lines"""
+        legacy_file = self.config.history_file.with_suffix(".json")
+        if legacy_file == self.config.history_file or not legacy_file.exists():
+            return
+        if self.config.history_file.stat().st_size > 0:
+            return
         try:
-            records = []
-            if self.config.history_file.exists():
-                with open(self.config.history_file, "r", encoding="utf-8") as f:
-                    records = json.load(f)
-            records.append({
-                "bvid": bvid,
-                "cid": cid,
-                "quality": quality,
-                "title": title,
-                "up": up_name,
-                "timestamp": int(time.time())
-            })
-            with open(self.config.history_file, "w", encoding="utf-8") as f:
-                json.dump(records, f, indent=2, ensure_ascii=False)
+            with open(legacy_file, "rb") as f:
+                records = orjson.loads(f.read())
+        except orjson.JSONDecodeError:
+            self.logger.error("旧版历史记录文件损坏，已忽略")
+            return
+        with open(self.config.history_file, "wb") as f:
+            for entry in records:
+                f.write(orjson.dumps(entry, option=orjson.OPT_APPEND_NEWLINE))
+        self.logger.info(f"已将 {len(records)} 条旧版历史记录迁移到 {self.config.history_file}")
+
+    def _save_download_entry(self, bvid: str, cid: int, quality: int, title: str, up_name: str,
+                             crc32c: Optional[str] = None, complete: bool = False):
+        entry = {
+            "bvid": bvid,
+            "cid": cid,
+            "quality": quality,
+            "title": title,
+            "up": up_name,
+            "timestamp": int(time.time())
+        }
+        if crc32c:
+            # 输出文件的校验和，便于事后核对文件是否损坏
+            entry["crc32c"] = crc32c
+        if complete:
+            # 该分P在最高画质模式下已全部下载完成，下次运行可直接跳过
+            entry["complete"] = True
+        try:
+            self._history_fp.write(orjson.dumps(entry, option=orjson.OPT_APPEND_NEWLINE))
         except Exception as e:
             self.logger.error(f"保存记录失败: {str(e)}")
 
+    def _mark_page_complete(self, bvid: str, cid: int, quality: int):
+        """
+        分P的各个画质此前已分别下载过，本次才凑齐，只追加一条完成标记；
+        整理历史记录时会与同一视频已有的记录合并
+        """
+        self._completed_pages.add((bvid, cid))
+        entry = {
+            "bvid": bvid,
+            "cid": cid,
+            "quality": quality,
+            "complete": True,
+            "timestamp": int(time.time())
+        }
+        try:
+            self._history_fp.write(orjson.dumps(entry, option=orjson.OPT_APPEND_NEWLINE))
+        except Exception as e:
+            self.logger.error(f"保存记录失败: {str(e)}")
+
+    def _compact_history(self):
+        """
+        退出时整理历史记录：去掉损坏行，重复记录合并为一条（同名字段以后写的为准）
+        没有需要清理的内容时不重写文件
+        """
+        try:
+            entries = {}
+            line_count = 0
+            with open(self.config.history_file, "rb") as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    line_count += 1
+                    try:
+                        item = orjson.loads(line)
+                        key = (item["bvid"], item["cid"], item["quality"])
+                    except (orjson.JSONDecodeError, KeyError, TypeError):
+                        continue
+                    # 只带完成标记的记录不能覆盖掉先前记录的标题、校验和等字段
+                    entries[key] = {**entries[key], **item} if key in entries else item
+            if len(entries) == line_count:
+                return
+            temp_file = self.config.history_file.with_name(self.config.history_file.name + ".tmp")
+            with open(temp_file, "wb") as f:
+                f.writelines(orjson.dumps(entry, option=orjson.OPT_APPEND_NEWLINE) for entry in entries.values())
+            os.replace(temp_file, self.config.history_file)
+        except Exception as e:
+            self.logger.error(f"整理历史记录失败: {str(e)}")
+
     # ------------------- 收藏夹获取 -------------------
-    def get_user_folders(self) -> List[Dict]:
+    async def get_user_folders(self) -> List[Dict]:
         try:
-            cookies = SimpleCookie()
-            try:
-                cookies.load(self.config.cookies.strip())
-            except CookieError as e:
-                self.logger.error(f"Cookie解析失败: {str(e)}")
-                return []
-            dede_userid = cookies.get("DedeUserID")
-            if not dede_userid or not dede_userid.value.isdigit():
+            if not self._dede_userid:
                 self.logger.error("无效的用户身份凭证，请检查Cookie中的DedeUserID")
                 return []
-            created = self._get_paginated_data(
+            folders = [folder async for folder in self._get_paginated_data(
                 "https://api.bilibili.com/x/v3/fav/folder/created/list",
-                {"up_mid": dede_userid.value},
+                {"up_mid": self._dede_userid},
                 data_key="list"
-            )
-            collected = self._get_paginated_data(
+            )]
+            async for folder in self._get_paginated_data(
                 "https://api.bilibili.com/x/v3/fav/folder/collected/list",
                 data_key="list"
-            )
-            return created + collected
+            ):
+                folders.append(folder)
+            return folders
         except Exception as e:
             self.logger.error(f"获取收藏夹失败: {str(e)}")
             return []
 
-    def _get_paginated_data(self, url: str, params: dict = None, data_key: str = "medias") -> List[Dict]:
-        results = []
+    async def _get_paginated_data(self, url: str, params: dict = None, data_key: str = "medias") -> AsyncIterator[Dict]:
+        """
+        逐页请求分页接口，用 ijson 边接收边解析，逐条产出 data[data_key] 中的条目
+        """
+        item_prefix = f"data.{data_key}.item"
         page = 1
+        retry = 0
         while True:
             try:
-                resp = self.session.get(url, params={"pn": page, "ps": 20, **(params or {})}, timeout=60)
-                resp.raise_for_status()
-                data = resp.json()
-                if data["code"] != 0:
-                    self.logger.error(f"API错误[{url}]: {data.get('message')}")
+                count = 0
+                code, message = None, None
+                builder = None
+                async with await self._get(url, params={"pn": page, "ps": 20, **(params or {})}) as resp:
+                    async for prefix, event, value in ijson.parse(resp.content, use_float=True):
+                        if builder is not None:
+                            builder.event(event, value)
+                            if prefix == item_prefix and event == "end_map":
+                                yield builder.value
+                                count += 1
+                                builder = None
+                        elif prefix == item_prefix and event == "start_map":
+                            builder = ijson.ObjectBuilder()
+                            builder.event(event, value)
+                        elif prefix == "code":
+                            code = value
+                        elif prefix == "message":
+                            message = value
+                if code in RATE_LIMIT_CODES and retry < 4:
+                    self._on_rate_limited(code, retry)
+                    retry += 1
+                    continue
+                if code not in RATE_LIMIT_CODES:
+                    self.limiter.reward()
+                if code != 0:
+                    self.logger.error(f"API错误[{url}]: {message}")
                     break
-                items = data["data"].get(data_key, [])
-                results.extend(items)
-                if len(items) < 20:
+                if count < 20:
                     break
                 page += 1
-                time.sleep(self.config.request_interval)
+                retry = 0
+                if self.config.request_interval > 0:
+                    await asyncio.sleep(self.config.request_interval)
             except Exception as e:
                 self.logger.error(f"请求失败: {str(e)}")
                 break
-        return results
 
     # ------------------- 视频处理 -------------------
-    def get_video_info(self, bvid: str) -> Optional[Dict]:
+    async def get_video_info(self, bvid: str) -> Optional[Dict]:
+        if bvid in self._view_cache:
+            return self._view_cache[bvid]
         try:
-            resp = self.session.get(f"https://api.bilibili.com/x/web-interface/view?bvid={bvid}", timeout=60)
-            resp.raise_for_status()
-            data = resp.json()
+            data = await self._get_json("https://api.bilibili.com/x/web-interface/view", params={"bvid": bvid})
             if data["code"] != 0:
                 self.logger.error(f"视频信息获取失败: {data.get('message')}")
                 return None
+            self._view_cache[bvid] = data["data"]
             return data["data"]
         except Exception as e:
             self.logger.error(f"请求异常: {str(e)}")
             return None
 
-    def get_available_qualities(self, bvid: str, cid: int) -> Dict[int, str]:
+    async def get_playinfo(self, bvid: str, cid: int) -> Optional[Tuple[Dict[int, str], Dict]]:
         """
-        获取视频可选清晰度列表，支持4K、HDR、8K等
+        一次 playurl 请求同时取得可选清晰度（支持4K、HDR、8K等）和 dash 流
+        返回 (清晰度字典, 按清晰度索引的 dash)，失败时返回 None
         """
         try:
-            resp = self.session.get(
-                "https://api.bilibili.com/x/player/playurl",
-                params={
-                    "bvid": bvid,
-                    "cid": cid,
-                    "qn": 0,
-                    "fnval": 4048,
-                    "fourk": 1,
-                    "fnver": 0
-                },
-                timeout=60
-            )
-            resp.raise_for_status()
-            data = resp.json()
-            if data["code"] != 0:
-                self.logger.error(f"清晰度接口错误: {data.get('message')}")
-                return {}
+            play_info = await self._fetch_playurl(bvid, cid, 0)
+            if not play_info:
+                return None
+            cached = self._playinfo_cache.get((bvid, cid))
+            if cached and cached[0] is play_info:
+                return cached[1]
             qualities = {}
-            for qn, desc in zip(data["data"]["accept_quality"], data["data"]["accept_description"]):
+            for qn, desc in zip(play_info["accept_quality"], play_info["accept_description"]):
                 if ":" in desc:
                     _, desc_part = desc.split(":", 1)
                     qualities[qn] = desc_part.strip()
                 else:
                     qualities[qn] = desc.strip()
-            return qualities
+            result = qualities, _index_dash(play_info.get("dash"))
+            self._playinfo_cache[(bvid, cid)] = (play_info, result)
+            return result
         except Exception as e:
             self.logger.error(f"清晰度获取失败: {str(e)}")
-            return {}
+            return None
+
+    async def _fetch_playurl(self, bvid: str, cid: int, qn: int) -> Optional[Dict]:
+        """
+        请求 playurl 接口并缓存 data 中用到的字段（清晰度列表与 dash 音视频流），接口报错时返回 None
+        """
+        key = (bvid, cid, qn)
+        cached = self._playurl_cache.get(key)
+        if cached and time.monotonic() - cached[0] < PLAYURL_TTL:
+            return cached[1]
+        data = await self._get_json(
+            "https://api.bilibili.com/x/player/playurl",
+            params={
+                "bvid": bvid,
+                "cid": cid,
+                "qn": qn,
+                "fnval": 4048,
+                "fourk": 1,
+                "fnver": 0
+            }
+        )
+        if data["code"] != 0:
+            self.logger.error(f"播放地址接口错误: {data.get('message')}")
+            return None
+        # 只保留用到的字段，其余（durl、support_formats、dolby/flac 等）随响应一起释放
+        info = data["data"]
+        dash = info.get("dash")
+        play_info = {
+            "accept_quality": info["accept_quality"],
+            "accept_description": info["accept_description"],
+            "dash": {"video": dash.get("video"), "audio": dash.get("audio")} if dash else None,
+        }
+        self._playurl_cache[key] = (time.monotonic(), play_info)
+        return play_info
+
+    def _invalidate_playurl(self, bvid: str, cid: int, quality: int):
+        """丢弃缓存的 playurl（地址已被 CDN 拒绝），下次解析地址时重新请求"""
+        self._playurl_cache.pop((bvid, cid, 0), None)
+        self._playurl_cache.pop((bvid, cid, quality), None)
 
-    def _download_media(self, url: str, path: Path) -> bool:
+    async def _download_media(self, url: URL, path: str) -> bool:
+        # 分段写入依赖 os.pwrite（Windows 不支持）
+        use_ranged = self.config.download_parts > 1 and hasattr(os, "pwrite")
         for retry in range(self.config.max_retries):
             try:
-                with self.session.get(url, stream=True, timeout=60) as r:
-                    r.raise_for_status()
-                    total_size = int(r.headers.get("content-length", 0))
-                    with open(path, "wb") as f, tqdm(
-                        desc=f"下载 {path.name}",
-                        total=total_size,
-                        unit="B",
-                        unit_scale=True,
-                        unit_divisor=1024,
-                    ) as bar:
-                        for chunk in r.iter_content(chunk_size=8192):
-                            if chunk:
-                                f.write(chunk)
-                                bar.update(len(chunk))
+                if use_ranged:
+                    if await self._download_ranged(url, path, self.config.download_parts):
+                        return True
+                    use_ranged = False
+                await self._download_single(url, path)
                 return True
             except Exception as e:
+                remove_file(path)
+                if _is_forbidden(e):
+                    # 同一地址重试没有意义，交给调用方重新获取地址
+                    raise _UrlExpired(path) from e
                 self.logger.warning(f"下载失败（重试 {retry+1}/{self.config.max_retries}）: {str(e)}")
-                if path.exists():
-                    path.unlink()
-                time.sleep(2)
+                await asyncio.sleep(2)
         return False
 
-    def _merge_files(self, video_path: Path, audio_path: Path, output_path: Path) -> bool:
+    async def _download_or_raise(self, url: URL, path: str):
+        if not await self._download_media(url, path):
+            raise _DownloadFailed(path)
+
+    async def _download_single(self, url: URL, path: str):
+        async with self.session.get(url) as r:
+            r.raise_for_status()
+            total_size = int(r.headers.get("content-length", 0))
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | O_BINARY)
+            try:
+                # 经过压缩的响应解码后大小与 Content-Length 不同，不预分配
+                if total_size and "content-encoding" not in r.headers:
+                    preallocate(fd, total_size)
+                advise_sequential(fd)
+                with tqdm(
+                    desc=f"下载 {os.path.basename(path)}",
+                    total=total_size,
+                    unit="B",
+                    unit_scale=True,
+                    unit_divisor=1024,
+                ) as bar:
+                    async with BatchWriter(fd) as writer:
+                        async for chunk in r.content.iter_chunked(CHUNK_SIZE):
+                            await writer.write(chunk)
+                            bar.update(len(chunk))
+                if writer.offset != total_size:
+                    os.ftruncate(fd, writer.offset)
+            finally:
+                os.close(fd)
+
+    async def _download_ranged(self, url: URL, path: str, parts: int = 4) -> bool:
+        """
+        按 Range 分段并发下载，各段通过 BatchWriter 写入预分配文件的对应偏移
+        返回 False 表示服务器不支持分段（或文件太小），调用方应回退到单连接下载
+        """
+        async with self.session.head(url, allow_redirects=True) as r:
+            if r.status != 200 or r.headers.get("accept-ranges", "").lower() != "bytes":
+                return False
+            total_size = int(r.headers.get("content-length", 0))
+        if total_size < parts * MIN_PART_SIZE:
+            return False
+
+        part_size = -(-total_size // parts)
+        ranges = [(start, min(start + part_size, total_size) - 1) for start in range(0, total_size, part_size)]
+
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | O_BINARY)
         try:
-            subprocess.run(
-                [
+            preallocate(fd, total_size)
+            advise_sequential(fd)
+            with tqdm(
+                desc=f"下载 {os.path.basename(path)}",
+                total=total_size,
+                unit="B",
+                unit_scale=True,
+                unit_divisor=1024,
+            ) as bar:
+                async with asyncio.TaskGroup() as tg:
+                    for start, end in ranges:
+                        tg.create_task(self._fetch_range(url, fd, start, end, bar))
+        except ExceptionGroup as eg:
+            if eg.subgroup(_RangeNotSupported) is not None:
+                return False
+            raise
+        finally:
+            os.close(fd)
+        return True
+
+    async def _fetch_range(self, url: URL, fd: int, start: int, end: int, bar: tqdm):
+        async with self.session.get(url, headers={"Range": f"bytes={start}-{end}"}) as r:
+            r.raise_for_status()
+            if r.status != 206:
+                raise _RangeNotSupported()
+            async with BatchWriter(fd, offset=start) as writer:
+                async for chunk in r.content.iter_chunked(CHUNK_SIZE):
+                    await writer.write(chunk)
+                    bar.update(len(chunk))
+            offset = writer.offset
+        if offset != end + 1:
+            raise aiohttp.ClientPayloadError(f"分段数据不完整: bytes={start}-{end}")
+
+    async def _merge_files(self, video_path: str, audio_path: str, output_path: Path) -> bool:
+        """
+        异步调用 FFmpeg 合并音视频，同时运行的 FFmpeg 进程数受 _merge_slots 限制
+        """
+        async with self._merge_slots:
+            try:
+                proc = await asyncio.create_subprocess_exec(
                     self.config.ffmpeg_path,
                     "-y",
                     "-loglevel", "error",
-                    "-i", str(video_path),
-                    "-i", str(audio_path),
+                    *FFMPEG_INPUT_ARGS, "-i", video_path,
+                    *FFMPEG_INPUT_ARGS, "-i", audio_path,
                     "-c", "copy",
-                    str(output_path)
-                ],
-                check=True,
-                stdout=subprocess.DEVNULL,
-                stderr=subprocess.DEVNULL
-            )
-            return True
-        except subprocess.CalledProcessError as e:
-            self.logger.error(f"合并失败: {e.stderr.decode()}")
-            return False
-        except Exception as e:
-            self.logger.error(f"FFmpeg异常: {str(e)}")
+                    str(output_path),
+                    stdout=asyncio.subprocess.DEVNULL,
+                    stderr=asyncio.subprocess.PIPE
+                )
+                _, stderr = await proc.communicate()
+            except Exception as e:
+                self.logger.error(f"FFmpeg异常: {str(e)}")
+                return False
+        if proc.returncode != 0:
+            self.logger.error(f"合并失败: {stderr.decode(errors='replace').strip()}")
             return False
+        return True
 
     # def download_video(self, bvid: str, cid: int, quality: int, dest_dir: Optional[Path] = None, suffix: str = "") -> bool:
     #     """
@@ -341,13 +967,32 @@ class BilibiliDownloader:
     #         self.logger.error(f"下载流程异常: {str(e)}")
     #         return False
 
-    def download_video(self, bvid: str, cid: int, quality: int, dest_dir: Optional[Path] = None, suffix: str = "") -> bool:
+    async def download_video(self, bvid: str, cid: int, quality: int, dest_dir: Optional[Path] = None, suffix: str = "",
+                             completes_page: bool = False) -> bool:
+        """
+        媒体地址在拿到下载名额后才解析（经带有效期的 playurl 缓存），排队期间地址过期也不受影响
+        completes_page 表示这次下载成功后该分P在最高画质模式下已全部完成，会记入历史供下次跳过
+        """
+        key = (bvid, cid, quality)
+        # 其他收藏夹正在下载同一内容时，等它结束后再判断是否还需要下载
+        while key in self._active_downloads:
+            await self._active_downloads[key].wait()
+        if self.is_downloaded(bvid, cid, quality):
+            self.logger.info(f"跳过已下载内容: {bvid}-{cid}")
+            if completes_page and (bvid, cid) not in self._completed_pages:
+                self._mark_page_complete(bvid, cid, quality)
+            return True
+        done = self._active_downloads[key] = asyncio.Event()
         try:
-            if (bvid, cid, quality) in self.downloaded:
-                self.logger.info(f"跳过已下载内容: {bvid}-{cid}")
-                return True
+            return await self._download_video(bvid, cid, quality, dest_dir, suffix, completes_page)
+        finally:
+            del self._active_downloads[key]
+            done.set()
 
-            video_info = self.get_video_info(bvid)
+    async def _download_video(self, bvid: str, cid: int, quality: int, dest_dir: Optional[Path], suffix: str,
+                              completes_page: bool) -> bool:
+        try:
+            video_info = await self.get_video_info(bvid)
             if not video_info:
                 return False
 
@@ -368,74 +1013,200 @@ class BilibiliDownloader:
             dest_dir.mkdir(parents=True, exist_ok=True)
             output_path = dest_dir / output_name
 
-            # 处理文件名冲突
+            # 处理文件名冲突（并发下载时还需避开其他任务已占用的文件名）
             counter = 1
-            while output_path.exists():
+            while output_path.exists() or output_path in self._pending_outputs:
                 output_name = f"{base_filename}_{counter}.mp4"
                 output_path = dest_dir / output_name
                 counter += 1
+            self._pending_outputs.add(output_path)
 
-            video_url, audio_url = self._get_media_urls(bvid, cid, quality)
-            if not video_url or not audio_url:
-                return False
+            try:
+                if self.config.pipe_to_ffmpeg and hasattr(os, "mkfifo"):
+                    success = await self._pipe_and_merge(bvid, cid, quality, output_path)
+                else:
+                    success = await self._download_and_merge(bvid, cid, quality, output_path)
 
-            temp_video = self.config.temp_dir / f"{bvid}_{cid}_video.m4s"
-            temp_audio = self.config.temp_dir / f"{bvid}_{cid}_audio.m4s"
+                if success:
+                    crc32c = await self._checksum(output_path)
+                    self._save_download_entry(bvid, cid, quality, base_filename, up_name, crc32c, completes_page)
+                    self._downloaded_session.add((bvid, cid, quality))
+                    if completes_page:
+                        self._completed_pages.add((bvid, cid))
+                return success
+            finally:
+                self._pending_outputs.discard(output_path)
+        except Exception as e:
+            self.logger.error(f"下载流程异常: {str(e)}")
+            return False
+
+    async def _checksum(self, path: Path) -> Optional[str]:
+        """
+        在线程中计算输出文件的 CRC32C，失败时只记录警告，不影响下载结果
+        """
+        try:
+            return await asyncio.to_thread(file_crc32c, path)
+        except OSError as e:
+            self.logger.warning(f"校验和计算失败: {str(e)}")
+            return None
+
+    async def _download_and_merge(self, bvid: str, cid: int, quality: int, output_path: Path) -> bool:
+        """
+        音视频先下载为临时 m4s 文件，再由 FFmpeg 合并
+        从开始下载到删除临时文件一直占用 _temp_slots 名额
+        """
+        temp_video = os.path.join(self.config._temp_str, f"{bvid}_{cid}_{quality}_video.m4s")
+        temp_audio = os.path.join(self.config._temp_str, f"{bvid}_{cid}_{quality}_audio.m4s")
+        async with self._temp_slots:
+            try:
+                # 音视频两路流同时下载；下载完成即释放名额，合并期间其他视频可以开始下载
+                # 任一路彻底失败时立即取消另一路，不再白白下载；TaskGroup 会等被取消的一路退出，
+                # 而 BatchWriter 退出前会等在途写入结束，所以下面 finally 删除临时文件时已没有写入在进行
+                async with self._download_slots:
+                    for attempt in range(2):
+                        video_url, audio_url = await self._get_media_urls(bvid, cid, quality)
+                        if not video_url or not audio_url:
+                            return False
+                        try:
+                            async with asyncio.TaskGroup() as tg:
+                                tg.create_task(self._download_or_raise(video_url, temp_video))
+                                tg.create_task(self._download_or_raise(audio_url, temp_audio))
+                            break
+                        except ExceptionGroup as eg:
+                            if eg.subgroup(_UrlExpired) is not None and attempt == 0:
+                                self.logger.warning(f"媒体地址已失效，重新获取: {bvid}-{cid}")
+                                self._invalidate_playurl(bvid, cid, quality)
+                                continue
+                            if eg.subgroup((_DownloadFailed, _UrlExpired)) is not None:
+                                return False
+                            raise
+
+                return await self._merge_files(temp_video, temp_audio, output_path)
+            finally:
+                # 临时文件不用 O_DIRECT 写入：FFmpeg 紧接着就要读取它们，留在页缓存里可以省掉一次读盘；
+                # 删除文件时内核会直接释放其页缓存，不必再单独丢弃
+                for temp in (temp_video, temp_audio):
+                    remove_file(temp)
+
+    async def _pipe_and_merge(self, bvid: str, cid: int, quality: int, output_path: Path) -> bool:
+        """
+        通过两个命名管道把音视频流边下载边送入 FFmpeg，下载与合并同时进行
+        网络错误时整体重试（CDN 返回 403 时先重新获取地址）；FFmpeg 本身报错则直接失败
+        """
+        video_fifo = os.path.join(self.config._temp_str, f"{bvid}_{cid}_{quality}_video.fifo")
+        audio_fifo = os.path.join(self.config._temp_str, f"{bvid}_{cid}_{quality}_audio.fifo")
+        async with self._download_slots:
+            for retry in range(self.config.max_retries):
+                video_url, audio_url = await self._get_media_urls(bvid, cid, quality)
+                if not video_url or not audio_url:
+                    return False
+                try:
+                    return await self._pipe_once(video_url, audio_url, video_fifo, audio_fifo, output_path)
+                except Exception as e:
+                    self.logger.warning(f"管道下载失败（重试 {retry+1}/{self.config.max_retries}）: {str(e)}")
+                    output_path.unlink(missing_ok=True)
+                    if _is_forbidden(e):
+                        self._invalidate_playurl(bvid, cid, quality)
+                    await asyncio.sleep(2)
+        return False
 
-            success = (
-                self._download_media(video_url, temp_video) and
-                self._download_media(audio_url, temp_audio) and
-                self._merge_files(temp_video, temp_audio, output_path)
+    async def _pipe_once(self, video_url: URL, audio_url: URL, video_fifo: str, audio_fifo: str,
+                         output_path: Path) -> bool:
+        for fifo in (video_fifo, audio_fifo):
+            remove_file(fifo)
+            os.mkfifo(fifo)
+        proc = None
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                self.config.ffmpeg_path,
+                "-y",
+                "-loglevel", "error",
+                *FFMPEG_INPUT_ARGS, "-i", video_fifo,
+                *FFMPEG_INPUT_ARGS, "-i", audio_fifo,
+                "-c", "copy",
+                str(output_path),
+                stdout=asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.PIPE
             )
+            async with asyncio.TaskGroup() as tg:
+                stderr_task = tg.create_task(proc.stderr.read())
+                tg.create_task(self._pipe_media(video_url, video_fifo, proc))
+                tg.create_task(self._pipe_media(audio_url, audio_fifo, proc))
+            await proc.wait()
+            if proc.returncode != 0:
+                output_path.unlink(missing_ok=True)
+                self.logger.error(f"合并失败: {stderr_task.result().decode(errors='replace').strip()}")
+                return False
+            return True
+        finally:
+            if proc is not None and proc.returncode is None:
+                proc.kill()
+                await proc.wait()
+            for fifo in (video_fifo, audio_fifo):
+                remove_file(fifo)
 
-            if success:
-                self._save_download_entry(bvid, cid, quality, base_filename, up_name)
-                self.downloaded.add((bvid, cid, quality))
+    async def _pipe_media(self, url: URL, fifo: str, proc: asyncio.subprocess.Process):
+        """
+        把一路媒体流写入命名管道；FFmpeg 提前退出时安静返回，由调用方根据退出码报错
+        """
+        # FFmpeg 按顺序打开输入，以非阻塞方式轮询，直到它打开管道的读端
+        while True:
+            try:
+                fd = os.open(fifo, os.O_WRONLY | os.O_NONBLOCK)
+                break
+            except OSError as e:
+                if e.errno != errno.ENXIO:
+                    raise
+            if proc.returncode is not None:
+                return
+            await asyncio.sleep(0.05)
 
-            temp_video.unlink(missing_ok=True)
-            temp_audio.unlink(missing_ok=True)
-            return success
-        except Exception as e:
-            self.logger.error(f"下载流程异常: {str(e)}")
-            return False
+        loop = asyncio.get_running_loop()
+        transport, protocol = await loop.connect_write_pipe(_PipeProtocol, os.fdopen(fd, "wb", buffering=0))
+        try:
+            async with self.session.get(url) as r:
+                r.raise_for_status()
+                with tqdm(
+                    desc=f"下载 {os.path.splitext(os.path.basename(fifo))[0]}",
+                    total=int(r.headers.get("content-length", 0)),
+                    unit="B",
+                    unit_scale=True,
+                    unit_divisor=1024,
+                ) as bar:
+                    async for chunk in r.content.iter_chunked(CHUNK_SIZE):
+                        transport.write(chunk)
+                        # 管道写满时等待 FFmpeg 读取
+                        await protocol.drain()
+                        bar.update(len(chunk))
+        except (BrokenPipeError, ConnectionResetError):
+            # FFmpeg 关闭了读端，说明它已退出
+            await proc.wait()
+        finally:
+            transport.close()
 
-    def _get_media_urls(self, bvid: str, cid: int, quality: int) -> Tuple[Optional[str], Optional[str]]:
+    async def _get_media_urls(self, bvid: str, cid: int, quality: int) -> Tuple[Optional[URL], Optional[URL]]:
         """
         获取媒体文件地址，传入支持高画质参数，
         并优先选取 hi-res（id==30251）的音频
+        复用 get_playinfo 缓存的同一份结果（超过 PLAYURL_TTL 自动重新请求），缺少所需画质时才按 qn 重新请求
+        地址只解析一次为 URL 对象（encoded=True 保持 CDN 签名参数原样），之后的 HEAD、分段请求与重试直接复用
         """
         try:
-            resp = self.session.get(
-                "https://api.bilibili.com/x/player/playurl",
-                params={
-                    "bvid": bvid,
-                    "cid": cid,
-                    "qn": quality,
-                    "fnval": 4048,
-                    "fourk": 1,
-                    "fnver": 0
-                },
-                timeout=60
-            )
-            resp.raise_for_status()
-            data = resp.json()
-            if data["code"] != 0:
-                return None, None
-            dash = data["data"].get("dash")
-            if not dash:
-                return None, None
-            video_stream = max((v for v in dash["video"] if v["id"] == quality),
-                               key=lambda x: x["bandwidth"],
-                               default=None)
-            hi_res_audio = next((a for a in dash["audio"] if a.get("id") == 30251), None)
-            if hi_res_audio is not None:
-                audio_stream = hi_res_audio
-            else:
-                audio_stream = max(dash["audio"], key=lambda x: x["bandwidth"], default=None)
+            playinfo = await self.get_playinfo(bvid, cid)
+            dash = playinfo[1] if playinfo else None
+            video_stream = dash["video"].get(quality) if dash else None
+            if video_stream is None:
+                play_info = await self._fetch_playurl(bvid, cid, quality)
+                if not play_info or not play_info.get("dash"):
+                    return None, None
+                dash = _index_dash(play_info["dash"])
+                video_stream = dash["video"].get(quality)
+            audio_stream = dash["audio"]
             if video_stream and audio_stream:
                 video_url = video_stream.get("baseUrl") or video_stream.get("base_url")
                 audio_url = audio_stream.get("baseUrl") or audio_stream.get("base_url")
-                return video_url, audio_url
+                if video_url and audio_url:
+                    return URL(video_url, encoded=True), URL(audio_url, encoded=True)
             return None, None
         except Exception as e:
             self.logger.error(f"媒体地址获取失败: {str(e)}")
@@ -454,17 +1225,13 @@ class BilibiliDownloader:
         """
         # 清理基础标题
         raw_title = video_info["title"]
-        base_title = re.sub(
-            r'[\\/:*?"<>|【】()\[\]《》\s\U00010000-\U0010ffff]',  # 过滤特殊符号和表情
-            " ", 
-            raw_title
-        ).strip()
-        base_title = re.sub(r'\s+', ' ', base_title)[:self.config.max_title_length]
+        base_title = _TITLE_SPECIAL_RE.sub(" ", raw_title).strip()
+        base_title = _SPACES_RE.sub(' ', base_title)[:self.config.max_title_length]
 
         # 处理分P信息
         page_num = page_info.get("page", 1)
         total_pages = len(video_info.get("pages", []))
-        page_part = re.sub(r'[\\/:*?"<>|]', "", page_info['part']).strip()
+        page_part = page_info['part'].translate(_FS_STRIP).strip()
         
         # 智能分P后缀处理
         page_suffix = ""
@@ -477,12 +1244,12 @@ class BilibiliDownloader:
         # 处理UP主名称
         up_display = ""
         if up_name != "unknown":
-            cleaned_up = re.sub(r'[^a-zA-Z0-9\u4e00-\u9fa5]', '', up_name)  # 去除非中英文字符
+            cleaned_up = _UPNAME_STRIP_RE.sub('', up_name)
             up_display = f"-{cleaned_up[:self.config.upname_max_length]}"
 
         # 组合各部分
         filename = f"{base_title}{page_suffix}{up_display}{suffix}"
-        filename = re.sub(r'_{2,}', '_', filename)  # 清理连续下划线
+        filename = _MULTI_UNDERSCORE_RE.sub('_', filename)  # 清理连续下划线
         return filename[:self.config.max_filename_length]
 
 # ===================== 用户交互类 =====================
@@ -526,14 +1293,150 @@ class InteractiveManager:
                 print("输入格式错误，示例：1,3")
 
 # ===================== 主程序 =====================
+def _listed_cids(media: Dict) -> List[int]:
+    """
+    收藏夹列表条目中各分P的 cid；列表未给出完整分P信息时返回空列表（不做跳过判断）
+    """
+    pages = media.get("pages") or []
+    cids = [page.get("id") or page.get("cid") for page in pages]
+    if not cids and media.get("page") == 1:
+        cids = [(media.get("ugc") or {}).get("first_cid")]
+    if not all(cids) or (media.get("page") and len(cids) != media["page"]):
+        return []
+    return cids
+
+
+async def process_folder(downloader: BilibiliDownloader, folder_info: Dict, use_highest_quality: bool,
+                         prompt_lock: asyncio.Lock):
+    """下载单个收藏夹，视频之间通过信号量限制并发数；手动选择清晰度时用 prompt_lock 串行提问"""
+    folder_id = folder_info["id"]
+    folder_title = folder_info["title"].translate(_FS_STRIP).strip() or folder_id
+    folder_dir = downloader.config.save_path / folder_title
+    folder_dir.mkdir(parents=True, exist_ok=True)
+    print(f"\n正在处理收藏夹: {folder_title} (ID: {folder_id})")
+
+    medias = [media async for media in downloader._get_paginated_data(
+        "https://api.bilibili.com/medialist/gateway/base/spaceDetail",
+        {"media_id": folder_id, "keyword": "", "order": "mtime", "type": 0, "tid": 0, "jsonp": "jsonp"},
+        data_key="medias"
+    )]
+
+    # 下载开始前先并发取回整个收藏夹的 view 与 playurl（用于选择清晰度），之后的下载可以一个接一个紧接着开始；
+    # 媒体地址会过期，下载时再经带有效期的缓存解析，不直接沿用这里的结果
+    # 下载并发由 downloader 内部限制；元数据请求的并发上限由所有收藏夹共享
+    async def limited(coro):
+        async with downloader._metadata_slots:
+            return await coro
+
+    bvids = list(dict.fromkeys(sys.intern(media["bvid"]) for media in medias if media.get("bvid")))
+    if use_highest_quality:
+        # 收藏夹列表自带各分P的 cid，当前全部分P都已完整下载的视频不再请求 view / playurl
+        listed_cids = {media["bvid"]: _listed_cids(media) for media in medias if media.get("bvid")}
+        remaining = [bvid for bvid in bvids if not downloader.is_video_downloaded(bvid, listed_cids[bvid])]
+        if len(remaining) < len(bvids):
+            print(f"跳过 {len(bvids) - len(remaining)} 个已下载的视频")
+        bvids = remaining
+    video_infos = dict(zip(bvids, await asyncio.gather(
+        *(limited(downloader.get_video_info(bvid)) for bvid in bvids)
+    )))
+    pages = [
+        (bvid, page["cid"])
+        for bvid, video_info in video_infos.items() if video_info
+        for page in video_info.get("pages", []) if page.get("cid")
+    ]
+    playinfos = dict(zip(pages, await asyncio.gather(
+        *(limited(downloader.get_playinfo(bvid, cid)) for bvid, cid in pages)
+    )))
+
+    async def process_media(bvid: str):
+        video_info = video_infos[bvid]
+        if not video_info:
+            print(f"跳过无效视频: {bvid}")
+            return
+
+        for page in video_info.get("pages", []):
+            cid = page.get("cid")
+            if not cid:
+                continue
+
+            playinfo = playinfos[(bvid, cid)]
+            if not playinfo or not playinfo[0]:
+                print(f"视频可能受地区限制或需要登录: {video_info['title']}")
+                continue
+            qualities = playinfo[0]
+
+            if use_highest_quality:
+                allowed = {16, 32, 64, 80, 112, 116, 120, 125, 127}
+                avail = allowed.intersection(set(qualities.keys()))
+                if avail:
+                    selected_quality = max(avail)
+                else:
+                    selected_quality = max(qualities.keys())
+            else:
+                async with prompt_lock:
+                    print(f"\n{video_info['title']} - {page['part']}")
+                    selected_quality = await asyncio.to_thread(InteractiveManager.select_quality, qualities)
+
+            # 检查是否支持HDR：根据描述中包含 "HDR" 或 "杜比视界"
+            hdr_candidates = [q for q, desc in qualities.items() if "HDR" in desc or "杜比视界" in desc]
+            hdr_quality = max(hdr_candidates) if hdr_candidates else None
+
+            # 下载最高画质版本（下载结果放在收藏夹目录下）
+            # 最高画质模式下，主版本与 HDR 版本中后完成的那次下载把该分P记为完整下载
+            main_completes = use_highest_quality and (
+                hdr_quality in (None, selected_quality) or downloader.is_downloaded(bvid, cid, hdr_quality)
+            )
+            if await downloader.download_video(bvid, cid, selected_quality, dest_dir=folder_dir,
+                                               completes_page=main_completes):
+                print(f"✓ 成功下载: {video_info['title']} - {page['part']}")
+            else:
+                print(f"✗ 下载失败: {video_info['title']} - {page['part']}")
+
+            if hdr_quality is not None:
+                hdr_dir = folder_dir / "hdr"
+                hdr_dir.mkdir(parents=True, exist_ok=True)
+                hdr_completes = use_highest_quality and downloader.is_downloaded(bvid, cid, selected_quality)
+                if await downloader.download_video(bvid, cid, hdr_quality, dest_dir=hdr_dir, suffix="-hdr",
+                                                   completes_page=hdr_completes):
+                    print(f"✓ HDR版本下载成功: {video_info['title']} - {page['part']}")
+                else:
+                    print(f"✗ HDR版本下载失败: {video_info['title']} - {page['part']}")
+
+    await asyncio.gather(*(process_media(bvid) for bvid in bvids))
+
+
+async def run(downloader: BilibiliDownloader, use_highest_quality: bool):
+    async with downloader:
+        folders = await downloader.get_user_folders()
+        if not folders:
+            print("错误：无法获取收藏夹，请检查Cookie或网络连接")
+            return
+
+        selected_ids = InteractiveManager.select_folders(folders)
+        if not selected_ids:
+            print("下载已取消")
+            return
+
+        folders_by_id = {f["id"]: f for f in folders}
+        # 多个收藏夹同时处理；手动选择清晰度时，同一时间只允许一个任务等待输入
+        prompt_lock = asyncio.Lock()
+        tasks = []
+        for folder_id in selected_ids:
+            folder_info = folders_by_id.get(folder_id)
+            if folder_info is None:
+                print(f"未找到收藏夹信息: {folder_id}")
+                continue
+            tasks.append(process_folder(downloader, folder_info, use_highest_quality, prompt_lock))
+        await asyncio.gather(*tasks)
+
 def main():
     try:
-        with open("config.json", encoding="utf-8") as f:
-            config_data = json.load(f)
+        with open("config.json", "rb") as f:
+            config_data = orjson.loads(f.read())
     except FileNotFoundError:
         print("错误：缺少配置文件 config.json")
         return
-    except json.JSONDecodeError:
+    except orjson.JSONDecodeError:
         print("错误：配置文件格式不正确")
         return
 
@@ -549,95 +1452,26 @@ def main():
         cookies=config_data.get("cookies", ""),
         save_path=Path(config_data.get("save_path", "./downloads")),
         ffmpeg_path=config_data.get("ffmpeg_path", "ffmpeg"),
-        request_interval=config_data.get("request_interval", 1.5),
+        request_interval=config_data.get("request_interval", 0.0),
         max_retries=config_data.get("max_retries", 3),
         # 新增配置项
         max_title_length=config_data.get("max_title_length", 80),
         max_filename_length=config_data.get("max_filename_length", 240),
-        upname_max_length=config_data.get("upname_max_length", 10)
+        upname_max_length=config_data.get("upname_max_length", 10),
+        max_concurrent_downloads=config_data.get("max_concurrent_downloads", 5),
+        download_parts=config_data.get("download_parts", 4),
+        pipe_to_ffmpeg=config_data.get("pipe_to_ffmpeg", False)
     )
 
     downloader = BilibiliDownloader(config)
-    print(f"已加载历史记录：{len(downloader.downloaded)} 条")
+    print(f"已加载历史记录：{downloader.downloaded_count} 条")
 
     use_highest_quality = False
     choice = input("是否以最高画质下载所有视频？(Y/n): ").strip().lower()
     if choice in ("", "y", "yes"):
         use_highest_quality = True
 
-    folders = downloader.get_user_folders()
-    if not folders:
-        print("错误：无法获取收藏夹，请检查Cookie或网络连接")
-        return
-
-    selected_ids = InteractiveManager.select_folders(folders)
-    if not selected_ids:
-        print("下载已取消")
-        return
-
-    for folder_id in selected_ids:
-        folder_info = next((f for f in folders if f["id"] == folder_id), None)
-        if folder_info is None:
-            print(f"未找到收藏夹信息: {folder_id}")
-            continue
-
-        folder_title = re.sub(r'[\\/:*?"<>|]', "", folder_info["title"]).strip() or folder_id
-        folder_dir = config.save_path / folder_title
-        folder_dir.mkdir(parents=True, exist_ok=True)
-        print(f"\n正在处理收藏夹: {folder_title} (ID: {folder_id})")
-
-        medias = downloader._get_paginated_data(
-            "https://api.bilibili.com/medialist/gateway/base/spaceDetail",
-            {"media_id": folder_id, "keyword": "", "order": "mtime", "type": 0, "tid": 0, "jsonp": "jsonp"},
-            data_key="medias"
-        )
-
-        for media in medias:
-            bvid = media.get("bvid")
-            if not bvid:
-                continue
-
-            video_info = downloader.get_video_info(bvid)
-            if not video_info:
-                print(f"跳过无效视频: {bvid}")
-                continue
-
-            for page in video_info.get("pages", []):
-                cid = page.get("cid")
-                if not cid:
-                    continue
-
-                qualities = downloader.get_available_qualities(bvid, cid)
-                if not qualities:
-                    print(f"视频可能受地区限制或需要登录: {video_info['title']}")
-                    continue
-
-                if use_highest_quality:
-                    allowed = {16, 32, 64, 80, 112, 116, 120, 125, 127}
-                    avail = allowed.intersection(set(qualities.keys()))
-                    if avail:
-                        selected_quality = max(avail)
-                    else:
-                        selected_quality = max(qualities.keys())
-                else:
-                    selected_quality = InteractiveManager.select_quality(qualities)
-
-                # 下载最高画质版本（下载结果放在收藏夹目录下）
-                if downloader.download_video(bvid, cid, selected_quality, dest_dir=folder_dir):
-                    print(f"✓ 成功下载: {video_info['title']} - {page['part']}")
-                else:
-                    print(f"✗ 下载失败: {video_info['title']} - {page['part']}")
-
-                # 检查是否支持HDR：根据描述中包含 "HDR" 或 "杜比视界"
-                hdr_candidates = [q for q, desc in qualities.items() if "HDR" in desc or "杜比视界" in desc]
-                if hdr_candidates:
-                    hdr_quality = max(hdr_candidates)
-                    hdr_dir = folder_dir / "hdr"
-                    hdr_dir.mkdir(parents=True, exist_ok=True)
-                    if downloader.download_video(bvid, cid, hdr_quality, dest_dir=hdr_dir, suffix="-hdr"):
-                        print(f"✓ HDR版本下载成功: {video_info['title']} - {page['part']}")
-                    else:
-                        print(f"✗ HDR版本下载失败: {video_info['title']} - {page['part']}")
+    asyncio.run(run(downloader, use_highest_quality))
 
 if __name__ == "__main__":
     main()